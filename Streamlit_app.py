@@ -1,9 +1,35 @@
 import streamlit as st
 import pandas as pd
-from geopy.distance import geodesic
+import math
+import numpy as np
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 from io import BytesIO
 
+EARTH_RADIUS_M = 6371000
+VEHICLE_SLACK = 2  # extra tractors over the capacity lower bound
+
+# --- Distance Matrix ---
+def haversine_matrix(lats, lons):
+    lat = np.radians(lats)
+    lon = np.radians(lons)
+    cos_lat = np.cos(lat)
+    n = len(lat)
+    matrix = np.zeros((n, n), dtype=np.int64)
+
+    # Symmetric with a zero diagonal: evaluate the upper-triangle pairs in one pass and mirror them
+    i, j = np.triu_indices(n, 1)
+    a = np.sin((lat[j] - lat[i]) / 2) ** 2
+    a += cos_lat[i] * cos_lat[j] * np.sin((lon[j] - lon[i]) / 2) ** 2
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_M
+    matrix[i, j] = matrix[j, i] = a.astype(np.int64)  # meters
+    return matrix
+
+def compute_distance_matrix(locations):
+    coords = np.asarray(locations, dtype=np.float64)
+    return haversine_matrix(coords[:, 0], coords[:, 1])
+
 # --- Load Data ---
 warehouse = ('Warehouse', 14.08397, 79.794420)
 data = [
@@ -27,95 +53,130 @@ data = [
 
 df_full = pd.DataFrame(data, columns=['Name', 'Latitude', 'Longitude', 'Type', 'Quantity'])
 
+# --- Precompute Distance Matrices ---
+# The dataset and warehouse are fixed, so each biomass type's matrix is built once per server process
+@st.cache_data
+def precompute_distance_matrices(df_full, warehouse):
+    matrices = {}
+    for biomass_type in df_full['Type'].unique():
+        df = df_full[df_full['Type'] == biomass_type]
+        locations = [(warehouse[1], warehouse[2])] + list(zip(df['Latitude'], df['Longitude']))
+        matrices[biomass_type] = compute_distance_matrix(locations)
+    return matrices
+
+DISTANCE_MATRICES = precompute_distance_matrices(df_full, warehouse)
+
 # --- Streamlit UI ---
 st.title("🚜 Biomass Route Optimizer")
 
 biomass_type = st.selectbox("Select Biomass Type:", df_full['Type'].unique())
-vehicle_capacity = st.number_input("Tractor Capacity (kg):", value=2000, step=100)
+vehicle_capacity = st.number_input("Tractor Capacity (kg):", min_value=100, value=2000, step=100)
 
 if st.button("Generate Routes"):
     df = df_full[df_full['Type'] == biomass_type].reset_index(drop=True)
     locations = [(warehouse[1], warehouse[2])] + list(zip(df['Latitude'], df['Longitude']))
-    demands = [0] + df['Quantity'].tolist()
-
-    def compute_distance_matrix(locations):
-        matrix = []
-        for loc1 in locations:
-            row = []
-            for loc2 in locations:
-                dist = geodesic(loc1, loc2).km
-                row.append(int(dist * 1000))  # meters
-            matrix.append(row)
-        return matrix
-
-    distance_matrix = compute_distance_matrix(locations)
-    num_vehicles = len(df)
-    depot = 0
-    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot)
-    routing = pywrapcp.RoutingModel(manager)
+    demands = np.concatenate(([0], df['Quantity'].to_numpy(dtype=np.int64)))
 
-    def distance_callback(from_index, to_index):
-        return distance_matrix[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    def demand_callback(from_index):
-        return demands[manager.IndexToNode(from_index)]
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-    routing.AddDimensionWithVehicleCapacity(
-        demand_callback_index, 0, [vehicle_capacity] * num_vehicles, True, 'Capacity')
-
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    solution = routing.SolveWithParameters(search_parameters)
+    distance_matrix = DISTANCE_MATRICES[biomass_type]
+    # OR-Tools takes plain int lists; convert once and reuse them if the solve is retried
+    transit_matrix = distance_matrix.tolist()
+    transit_demands = demands.tolist()
+    depot = 0
+    # Capacity lower bound plus slack; retry with one tractor per supplier if infeasible
+    vehicle_bounds = [min(len(df), math.ceil(demands.sum() / vehicle_capacity) + VEHICLE_SLACK), len(df)]
+    for num_vehicles in vehicle_bounds:
+        manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot)
+        routing = pywrapcp.RoutingModel(manager)
+
+        transit_callback_index = routing.RegisterTransitMatrix(transit_matrix)
+        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+        demand_callback_index = routing.RegisterUnaryTransitVector(transit_demands)
+        routing.AddDimensionWithVehicleCapacity(
+            demand_callback_index, 0, [vehicle_capacity] * num_vehicles, True, 'Capacity')
+
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+        # The built-in dataset is tiny: take the first solution instead of running local search
+        search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.UNSET
+        search_parameters.solution_limit = 1
+        search_parameters.time_limit.seconds = 1
+        solution = routing.SolveWithParameters(search_parameters)
+        if solution or num_vehicles == len(df):
+            break
 
     if solution:
-        tractor_count = 1
-        route_data = {
-            'Tractor': [],
-            'Stop Order': [],
-            'Name': [],
-            'Quantity (kg)': [],
-            'Google Maps Link': []
-        }
+        names = df['Name'].to_numpy()
+        qtys = df['Quantity'].to_numpy()
 
+        # Map solver indices to nodes once; end indices start at routing.Size() and all map to the depot
+        size = routing.Size()
+        node_of = np.fromiter((manager.IndexToNode(i) for i in range(size)), dtype=np.int64, count=size)
+
+        # First pass: collect routes of used tractors so the output columns can be preallocated
+        routes = []
         for vehicle_id in range(num_vehicles):
+            if not routing.IsVehicleUsed(solution, vehicle_id):
+                continue
             index = routing.Start(vehicle_id)
             route = []
-            route_load = 0
-            while not routing.IsEnd(index):
-                node_index = manager.IndexToNode(index)
+            while index < size:
+                node_index = node_of[index]
                 route.append(node_index)
-                route_load += demands[node_index]
                 index = solution.Value(routing.NextVar(index))
-            route.append(manager.IndexToNode(index))
-
-            if len(route) > 2:
-                # Generate Google Maps link
-                gmap_base = "https://www.google.com/maps/dir/"
-                waypoints = [f"{locations[i][0]},{locations[i][1]}" for i in route]
-                gmap_link = gmap_base + "/".join(waypoints)
-
-                for stop_index, i in enumerate(route):
-                    name = 'Warehouse' if i == 0 else df.iloc[i - 1]['Name']
-                    qty = 0 if i == 0 else df.iloc[i - 1]['Quantity']
-
-                    route_data['Tractor'].append(tractor_count if stop_index == 0 else "")
-                    route_data['Stop Order'].append(stop_index + 1)
-                    route_data['Name'].append(name)
-                    route_data['Quantity (kg)'].append(qty)
-                    route_data['Google Maps Link'].append(gmap_link if stop_index == 0 else "")
-
-                tractor_count += 1
-
-        route_df = pd.DataFrame(route_data)
-        st.success(f"✅ Found {tractor_count - 1} optimized routes.")
+            route.append(depot)
+            routes.append(route)
+
+        total_stops = sum(len(route) for route in routes)
+        tractor_col = np.full(total_stops, "", dtype=object)
+        stop_col = np.empty(total_stops, dtype=np.int64)
+        name_col = np.empty(total_stops, dtype=object)
+        qty_col = np.empty(total_stops, dtype=qtys.dtype)
+        link_col = np.full(total_stops, "", dtype=object)
+
+        gmap_base = "https://www.google.com/maps/dir/"
+        locs_str = [f"{lat},{lon}" for lat, lon in locations]
+
+        # Second pass: write each route into its slice of the columns
+        k = 0
+        for tractor_count, route in enumerate(routes, start=1):
+            # Generate Google Maps link
+            gmap_link = gmap_base + "/".join(locs_str[i] for i in route)
+
+            nodes = np.asarray(route)
+            is_depot = nodes == 0
+            end_k = k + len(route)
+            tractor_col[k] = tractor_count
+            stop_col[k:end_k] = np.arange(1, len(route) + 1)
+            name_col[k:end_k] = np.where(is_depot, 'Warehouse', names[nodes - 1])
+            qty_col[k:end_k] = np.where(is_depot, 0, qtys[nodes - 1])
+            link_col[k] = gmap_link
+            k = end_k
+
+        route_df = pd.DataFrame({
+            'Tractor': tractor_col,
+            'Stop Order': stop_col,
+            'Name': name_col,
+            'Quantity (kg)': qty_col,
+            'Google Maps Link': link_col
+        })
+        st.success(f"✅ Found {len(routes)} optimized routes.")
         st.dataframe(route_df)
 
         # --- Download Excel ---
         buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            route_df.to_excel(writer, sheet_name=biomass_type, index=False)
+        # constant_memory flushes each row as soon as the next one starts, so rows must be
+        # written in order (to_excel writes column by column and would drop data)
+        with pd.ExcelWriter(buffer, engine='xlsxwriter',
+                            engine_kwargs={'options': {'constant_memory': True}}) as writer:
+            workbook = writer.book
+            worksheet = workbook.add_worksheet(biomass_type)
+            header_format = workbook.add_format({'bold': True, 'border': 1})
+            # NaN -> None so missing values are written as blank cells, as to_excel did
+            excel_df = route_df.astype(object).where(route_df.notna(), None)
+            worksheet.write_row(0, 0, excel_df.columns, header_format)
+            for row_num, row in enumerate(excel_df.itertuples(index=False), start=1):
+                worksheet.write_row(row_num, 0, row)
         st.download_button(
             label="📥 Download Routes as Excel",
             data=buffer.getvalue(),
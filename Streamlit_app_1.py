@@ -1,37 +1,78 @@
 import streamlit as st
 import pandas as pd
-from geopy.distance import geodesic
+import math
+import numpy as np
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 from io import BytesIO
 
+EARTH_RADIUS_M = 6371000
+VEHICLE_SLACK = 2  # extra tractors over the capacity lower bound
+
 st.set_page_config(page_title="Biomass Route Optimizer", layout="wide")
 st.title("🚜 Biomass Route Optimizer")
 
 # --- 🔄 Split Function for Oversized Loads ---
 def split_oversized_suppliers(df, capacity):
-    new_rows = []
-    for idx, row in df.iterrows():
-        qty = row['Biomass Quantity']
-        if qty <= capacity:
-            new_rows.append(row)
-        else:
-            n_chunks = qty // capacity
-            remainder = qty % capacity
-
-            # Full-capacity chunks
-            for i in range(int(n_chunks)):
-                chunk = row.copy()
-                chunk['Biomass Quantity'] = capacity
-                chunk['Supplier Name (Farmer Name)'] += f" (Split-{i+1})"
-                new_rows.append(chunk)
-
-            # Remaining load
-            if remainder > 0:
-                chunk = row.copy()
-                chunk['Biomass Quantity'] = remainder
-                chunk['Supplier Name (Farmer Name)'] += f" (Split-R)"
-                new_rows.append(chunk)
-    return pd.DataFrame(new_rows)
+    qty = df['Biomass Quantity'].to_numpy()
+    oversized = qty > capacity
+    n_chunks = np.where(oversized, qty // capacity, 0).astype(np.int64)
+    remainder = np.where(oversized, qty % capacity, 0)
+
+    # Rows kept as-is count once; oversized rows expand to full chunks + remainder
+    counts = np.where(oversized, n_chunks + (remainder > 0), 1)
+    row_idx = np.repeat(np.arange(len(df)), counts)
+    chunk_no = np.arange(len(row_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    out = df.iloc[row_idx].reset_index(drop=True)
+    is_split = oversized[row_idx]
+    is_full = is_split & (chunk_no < n_chunks[row_idx])
+    is_rem = is_split & ~is_full
+
+    out['Biomass Quantity'] = np.where(is_full, capacity, np.where(is_rem, remainder[row_idx], qty[row_idx]))
+    # Only split rows get a name suffix; other names (which may be numeric IDs) stay untouched
+    col = 'Supplier Name (Farmer Name)'
+    split_no = pd.Series(chunk_no[is_split] + 1).astype(str).to_numpy(dtype=object)
+    suffix = np.where(is_full[is_split], " (Split-" + split_no + ")", " (Split-R)")
+    out[col] = out[col].astype(object)
+    out.loc[is_split, col] = out.loc[is_split, col].astype(str) + suffix
+    return out
+
+# --- 📏 Haversine Distance Matrix ---
+def haversine_matrix(lats, lons):
+    lat = np.radians(lats)
+    lon = np.radians(lons)
+    cos_lat = np.cos(lat)
+    n = len(lat)
+    matrix = np.zeros((n, n), dtype=np.int64)
+
+    # Symmetric with a zero diagonal: evaluate the upper-triangle pairs in one pass and mirror them
+    i, j = np.triu_indices(n, 1)
+    a = np.sin((lat[j] - lat[i]) / 2) ** 2
+    a += cos_lat[i] * cos_lat[j] * np.sin((lon[j] - lon[i]) / 2) ** 2
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_M
+    matrix[i, j] = matrix[j, i] = a.astype(np.int64)  # meters
+    return matrix
+
+# Uploads are arbitrary, so bound both caches instead of keeping every file/matrix for the server's lifetime
+@st.cache_data(max_entries=16, ttl=3600)
+def compute_distance_matrix(locations):
+    coords = np.asarray(locations, dtype=np.float64)
+    return haversine_matrix(coords[:, 0], coords[:, 1])
+
+# --- 📂 Cached File Reader ---
+# Coordinates stay float64 so the Maps links show exactly what was uploaded
+SUPPLIER_DTYPES = {
+    'Biomass Type': 'category',
+    'Biomass Quantity': np.int32
+}
+
+@st.cache_data(max_entries=4, ttl=3600)
+def load_supplier_file(file_name, file_bytes):
+    if file_name.endswith('.csv'):
+        return pd.read_csv(BytesIO(file_bytes), dtype=SUPPLIER_DTYPES)
+    return pd.read_excel(BytesIO(file_bytes), engine='openpyxl', dtype=SUPPLIER_DTYPES)
 
 # --- 📍 Warehouse & Capacity Input ---
 with st.expander("📍 Enter Warehouse Location"):
@@ -49,11 +90,11 @@ st.caption("💡 Required columns: 'Supplier Name (Farmer Name)', 'Latitude of t
 if uploaded_file:
     try:
         if uploaded_file.name.endswith('.csv'):
-            df_full = pd.read_csv(uploaded_file)
+            df_full = load_supplier_file(uploaded_file.name, uploaded_file.getvalue())
         elif uploaded_file.name.endswith('.xlsx'):
             try:
                 import openpyxl
-                df_full = pd.read_excel(uploaded_file, engine='openpyxl')
+                df_full = load_supplier_file(uploaded_file.name, uploaded_file.getvalue())
             except ImportError:
                 st.error("❌ You need to install the `openpyxl` package to read Excel files.\n\nRun: `pip install openpyxl`")
                 st.stop()
@@ -80,7 +121,7 @@ if uploaded_file:
             st.stop()
 
         # 🌿 Select Biomass Type
-        biomass_type = st.selectbox("🌿 Select Biomass Type:", df_full['Biomass Type'].unique())
+        biomass_type = st.selectbox("🌿 Select Biomass Type:", df_full['Biomass Type'].unique().tolist())
 
         if st.button("Generate Routes"):
             df = df_full[df_full['Biomass Type'] == biomass_type].reset_index(drop=True)
@@ -88,107 +129,126 @@ if uploaded_file:
 
             # 📍 Build distance matrix
             locations = [(warehouse[1], warehouse[2])] + list(zip(df['Latitude of the location'], df['Longitude of the location']))
-            demands = [0] + df['Biomass Quantity'].tolist()
-
-            def compute_distance_matrix(locations):
-                matrix = []
-                for loc1 in locations:
-                    row = []
-                    for loc2 in locations:
-                        dist = geodesic(loc1, loc2).km
-                        row.append(int(dist * 1000))  # meters
-                    matrix.append(row)
-                return matrix
-
-            distance_matrix = compute_distance_matrix(locations)
-            num_vehicles = len(df)
+            demands = np.concatenate(([0], df['Biomass Quantity'].to_numpy(dtype=np.int64)))
+
+            distance_matrix = compute_distance_matrix(tuple(locations))
+            # OR-Tools takes plain int lists; convert once and reuse them if the solve is retried
+            transit_matrix = distance_matrix.tolist()
+            transit_demands = demands.tolist()
             depot = 0
-            manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot)
-            routing = pywrapcp.RoutingModel(manager)
-
-            def distance_callback(from_index, to_index):
-                return distance_matrix[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
-            transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-            routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-            def demand_callback(from_index):
-                return demands[manager.IndexToNode(from_index)]
-            demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-            routing.AddDimensionWithVehicleCapacity(
-                demand_callback_index, 0, [tractor_capacity] * num_vehicles, True, 'Capacity')
-
-            # Search parameters
-            search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-            search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-            search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-            search_parameters.time_limit.seconds = 10
-            for vehicle_id in range(num_vehicles):
-                routing.SetFixedCostOfVehicle(10000, vehicle_id)
-
-            solution = routing.SolveWithParameters(search_parameters)
+            # Capacity lower bound plus slack; retry with one tractor per supplier if infeasible
+            vehicle_bounds = [min(len(df), math.ceil(demands.sum() / tractor_capacity) + VEHICLE_SLACK), len(df)]
+            for num_vehicles in vehicle_bounds:
+                manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot)
+                routing = pywrapcp.RoutingModel(manager)
+
+                transit_callback_index = routing.RegisterTransitMatrix(transit_matrix)
+                routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+                demand_callback_index = routing.RegisterUnaryTransitVector(transit_demands)
+                routing.AddDimensionWithVehicleCapacity(
+                    demand_callback_index, 0, [tractor_capacity] * num_vehicles, True, 'Capacity')
+
+                # Search parameters
+                search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+                search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+                search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+                search_parameters.time_limit.seconds = 10
+                for vehicle_id in range(num_vehicles):
+                    routing.SetFixedCostOfVehicle(10000, vehicle_id)
+
+                solution = routing.SolveWithParameters(search_parameters)
+                if solution or num_vehicles == len(df):
+                    break
 
             if solution:
-                tractor_count = 1
-                route_data = {
-                    'Tractor': [],
-                    'Stop Order': [],
-                    'Name': [],
-                    'Quantity (kg)': [],
-                    'Utilization (%)': [],
-                    'Google Maps Link': [],
-                    'Highlight': []
-                }
+                names = df['Supplier Name (Farmer Name)'].to_numpy()
+                qtys = df['Biomass Quantity'].to_numpy()
 
+                # Map solver indices to nodes once; end indices start at routing.Size() and all map to the depot
+                size = routing.Size()
+                node_of = np.fromiter((manager.IndexToNode(i) for i in range(size)), dtype=np.int64, count=size)
+
+                # First pass: collect routes of used tractors so the output columns can be preallocated
+                routes = []
                 for vehicle_id in range(num_vehicles):
+                    if not routing.IsVehicleUsed(solution, vehicle_id):
+                        continue
                     index = routing.Start(vehicle_id)
                     route = []
                     load_this_route = 0
-                    while not routing.IsEnd(index):
-                        node_index = manager.IndexToNode(index)
+                    while index < size:
+                        node_index = node_of[index]
                         route.append(node_index)
                         if node_index != 0:
                             load_this_route += demands[node_index]
                         index = solution.Value(routing.NextVar(index))
-                    route.append(manager.IndexToNode(index))
-
-                    if len(route) > 2:
-                        utilization = (load_this_route / tractor_capacity) * 100
-                        gmap_base = "https://www.google.com/maps/dir/"
-                        waypoints = [f"{locations[i][0]},{locations[i][1]}" for i in route]
-                        gmap_link = gmap_base + "/".join(waypoints)
-
-                        for stop_index, i in enumerate(route):
-                            name = 'Warehouse' if i == 0 else df.iloc[i - 1]['Supplier Name (Farmer Name)']
-                            qty = 0 if i == 0 else df.iloc[i - 1]['Biomass Quantity']
-                            util_str = f"{utilization:.1f}%" if stop_index == 0 else ""
-                            highlight = utilization < 60 and stop_index == 0
-
-                            route_data['Tractor'].append(f"Tractor {tractor_count}" if stop_index == 0 else "")
-                            route_data['Stop Order'].append(stop_index + 1)
-                            route_data['Name'].append(name)
-                            route_data['Quantity (kg)'].append(qty)
-                            route_data['Utilization (%)'].append(util_str)
-                            route_data['Google Maps Link'].append(gmap_link if stop_index == 0 else "")
-                            route_data['Highlight'].append(highlight)
-
-                        tractor_count += 1
+                    route.append(depot)
+                    routes.append((route, load_this_route))
+
+                total_stops = sum(len(route) for route, _ in routes)
+                tractor_col = np.full(total_stops, "", dtype=object)
+                stop_col = np.empty(total_stops, dtype=np.int64)
+                name_col = np.empty(total_stops, dtype=object)
+                qty_col = np.empty(total_stops, dtype=qtys.dtype)
+                util_col = np.full(total_stops, "", dtype=object)
+                link_col = np.full(total_stops, "", dtype=object)
+                highlight_col = np.zeros(total_stops, dtype=bool)
+
+                gmap_base = "https://www.google.com/maps/dir/"
+                locs_str = [f"{lat},{lon}" for lat, lon in locations]
+
+                # Second pass: write each route into its slice of the columns
+                k = 0
+                for tractor_count, (route, load_this_route) in enumerate(routes, start=1):
+                    utilization = (load_this_route / tractor_capacity) * 100
+                    gmap_link = gmap_base + "/".join(locs_str[i] for i in route)
+
+                    nodes = np.asarray(route)
+                    is_depot = nodes == 0
+                    end_k = k + len(route)
+                    tractor_col[k] = f"Tractor {tractor_count}"
+                    stop_col[k:end_k] = np.arange(1, len(route) + 1)
+                    name_col[k:end_k] = np.where(is_depot, 'Warehouse', names[nodes - 1])
+                    qty_col[k:end_k] = np.where(is_depot, 0, qtys[nodes - 1])
+                    util_col[k] = f"{utilization:.1f}%"
+                    link_col[k] = gmap_link
+                    highlight_col[k] = utilization < 60
+                    k = end_k
 
                 # ✅ Show results in Streamlit (no Highlight column)
-                route_df = pd.DataFrame(route_data)
-                st.success(f"✅ Found {tractor_count - 1} optimized routes.")
+                route_df = pd.DataFrame({
+                    'Tractor': tractor_col,
+                    'Stop Order': stop_col,
+                    'Name': name_col,
+                    'Quantity (kg)': qty_col,
+                    'Utilization (%)': util_col,
+                    'Google Maps Link': link_col,
+                    'Highlight': highlight_col
+                })
+                st.success(f"✅ Found {len(routes)} optimized routes.")
                 st.dataframe(route_df.drop(columns=['Highlight']))
 
                 # 💾 Save to Excel with Yellow Highlight
                 buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    route_df.drop(columns=['Highlight']).to_excel(writer, sheet_name=biomass_type, index=False)
+                # constant_memory flushes each row as soon as the next one starts, so rows (and their
+                # highlight) must be written in order (to_excel writes column by column and would drop data)
+                with pd.ExcelWriter(buffer, engine='xlsxwriter',
+                                    engine_kwargs={'options': {'constant_memory': True}}) as writer:
                     workbook = writer.book
-                    worksheet = writer.sheets[biomass_type]
+                    worksheet = workbook.add_worksheet(biomass_type)
+                    header_format = workbook.add_format({'bold': True, 'border': 1})
                     yellow_format = workbook.add_format({'bg_color': '#FFFF00'})
 
-                    for row_num, highlight in enumerate(route_df['Highlight'], start=1):  # Skip header
-                        if highlight:
+                    excel_df = route_df.drop(columns=['Highlight'])
+                    # NaN -> None so missing values are written as blank cells, as to_excel did
+                    excel_df = excel_df.astype(object).where(excel_df.notna(), None)
+                    highlight = route_df['Highlight'].to_numpy()
+                    worksheet.write_row(0, 0, excel_df.columns, header_format)
+                    for row_num, row in enumerate(excel_df.itertuples(index=False), start=1):  # Skip header
+                        if highlight[row_num - 1]:
                             worksheet.set_row(row_num, None, yellow_format)
+                        worksheet.write_row(row_num, 0, row)
 
                 st.download_button(
                     label="📥 Download Routes as Excel",